@@ -1,6 +1,21 @@
 import app.core as core
 import storage.movie_storage_sql as movie_storage
-import sqlite3
+
+# Menu choices that run a core action for the active user. Choices that
+# end or switch the session (0, 11, 12) are handled in run_user_session.
+# The lambdas look core up at call time, as core also imports this module.
+_MENU_ACTIONS = {
+    "1": lambda user_id, user_name: core.list_movies(user_id),
+    "2": lambda user_id, user_name: core.add_movie(user_id),
+    "3": lambda user_id, user_name: core.delete_movie(user_id),
+    "4": lambda user_id, user_name: core.update_movie(user_id),
+    "5": lambda user_id, user_name: core.stats(user_id),
+    "6": lambda user_id, user_name: core.random_movie(user_id),
+    "7": lambda user_id, user_name: core.search_movie(user_id),
+    "8": lambda user_id, user_name: core.movies_sorted_by_rating(user_id),
+    "9": lambda user_id, user_name: core.movies_sorted_by_year(user_id),
+    "10": lambda user_id, user_name: core.generate_website(user_id, user_name),
+}
 
 # ---------------- Helper Functions ---------------- #
 
@@ -22,10 +37,13 @@ def safe_float_input(prompt):
     Asks for a float input safely, keeps asking until valid input is given.
     """
     while True:
-        try:
-            return float(input(prompt))
-        except ValueError:
-            print("Invalid input. Please enter a number.")
+        text = input(prompt).strip()
+        # Accept plain decimals like "7", "-2" or "8.5" without relying on
+        # float() raising for everything else
+        digits = text[1:] if text[:1] in "+-" else text
+        if digits.replace(".", "", 1).isdecimal():
+            return float(text)
+        print("Invalid input. Please enter a number.")
 
 
 def safe_int_input(prompt):
@@ -33,10 +51,11 @@ def safe_int_input(prompt):
     Asks for an integer input safely, keeps asking until valid input is given.
     """
     while True:
-        try:
-            return int(input(prompt))
-        except ValueError:
-            print("Invalid input. Please enter an integer.")
+        text = input(prompt).strip()
+        digits = text[1:] if text[:1] in "+-" else text
+        if digits.isdecimal():
+            return int(text)
+        print("Invalid input. Please enter an integer.")
 
 
 def wait_for_enter():
@@ -58,28 +77,14 @@ def print_welcome():
     print("********** My Movies App **********\n")
 
 
-def get_all_users():
-    """Retrieves all users from the database for display."""
-    # Use a direct query since this logic isn't in movie_storage yet
-    import sqlite3
-    try:
-        conn = sqlite3.connect('data/movies.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name FROM users")
-        users = cursor.fetchall()
-        conn.close()
-        return users
-    except sqlite3.OperationalError:
-        # Happens if the database file is new and the table hasn't been created yet.
-        return []
-
-
 def select_user():
     """
     Displays existing users, allows creation of a new user, and returns the selected user's ID and name.
     """
+    # Only changes when a user is created, so fetch it once up front
+    users = movie_storage.get_all_users()
+
     while True:
-        users = get_all_users()
         print("\nWelcome to the Movie App! 🎬")
         print("Select a user:")
 
@@ -147,29 +152,12 @@ def run_user_session(user_id, user_name):
             choice = input("Enter choice (0–12): ").strip()
             print()
 
-            if choice == "0":
+            action = _MENU_ACTIONS.get(choice)
+            if action:
+                action(user_id, user_name)
+            elif choice == "0":
                 print(f"Bye, {user_name}! 👋")
                 return False
-            elif choice == "1":
-                core.list_movies(user_id)
-            elif choice == "2":
-                core.add_movie(user_id)
-            elif choice == "3":
-                core.delete_movie(user_id)
-            elif choice == "4":
-                core.update_movie(user_id)
-            elif choice == "5":
-                core.stats(user_id)
-            elif choice == "6":
-                core.random_movie(user_id)
-            elif choice == "7":
-                core.search_movie(user_id)
-            elif choice == "8":
-                core.movies_sorted_by_rating(user_id)
-            elif choice == "9":
-                core.movies_sorted_by_year(user_id)
-            elif choice == "10":
-                core.generate_website(user_id, user_name)
             elif choice == "11":
                 print(f"Switching user from {user_name}...")
                 return True
@@ -183,22 +171,56 @@ def run_user_session(user_id, user_name):
             print()
 
         except Exception as e:
+            # Don't trust cached movies after a failed action
+            movie_storage.invalidate_movies_cache(user_id)
             print(f"\n⚠️ Oops! Something went wrong: {e}")
             print("Don’t worry, you can try again.\n")
 
 
+def run_batch(user_id, user_name, commands):
+    """
+    Runs a sequence of menu choices (1–10) for a user without showing the
+    menu or waiting for Enter in between. Actions that need more input,
+    such as a movie title, still read it from standard input.
+
+    Returns:
+        bool: True if every choice was run. False if an invalid one was
+        given, in which case none of them are run, or if one failed, in
+        which case the choices after it are skipped.
+    """
+    # Check every choice first so a typo doesn't leave the run half done
+    actions = []
+    for choice in commands:
+        action = _MENU_ACTIONS.get(choice.strip())
+        if action is None:
+            print(f"Invalid batch choice '{choice}'. Use numbers from 1–10.")
+            return False
+        actions.append((choice.strip(), action))
+
+    for choice, action in actions:
+        try:
+            action(user_id, user_name)
+        except EOFError:
+            print(f"\n⚠️ Batch input ended before choice {choice} finished.")
+            return False
+        except Exception as e:
+            # Don't trust cached movies after a failed action
+            movie_storage.invalidate_movies_cache(user_id)
+            print(f"\n⚠️ Oops! Something went wrong in choice {choice}: {e}")
+            return False
+    return True
+
+
 def delete_active_user(user_id, user_name):
     """Handles the process of deleting the currently logged-in user."""
     print(f"\n⚠️ WARNING: You are about to delete user '{user_name}' and ALL their movies.")
     confirmation = input("Type 'DELETE' to confirm this action: ").strip()
 
     if confirmation == "DELETE":
-        # 1. Delete dependent rows (movies)
-        movies_deleted = movie_storage.delete_movies_by_user_id(user_id)
-        
-        # 2. Delete the user
-        user_deleted = movie_storage.delete_user(user_id)
-        
+        # Delete the user's movies and the user together in one transaction
+        user_deleted, movies_deleted = movie_storage.delete_user_with_movies(
+            user_id)
+
         if user_deleted:
             print(f"✅ User '{user_name}' and {movies_deleted} movie(s) successfully deleted.")
             # Returns True to force user switch/exit after successful deletion
@@ -1,46 +1,67 @@
-import random
-import statistics
-import requests
+import functools
+import html
+import itertools
 import storage.movie_storage_sql as movie_storage
-import movies_api as api
 import app.cli as cli
 
+# HTML list item for a single movie in the website grid
+MOVIE_TILE_TEMPLATE = """
+        <li>
+            <div class="movie">
+                <img class="movie-poster"
+                     src="{poster_url}"
+                     alt="{title} - Rating: {rating}">
+                <div class="movie-title">{title}</div>
+                <div class="movie-year">({year})</div>
+            </div>
+        </li>
+        """
 
-def create_movie_tiles(movies):
+
+def create_movie_tiles(rows):
     """
-    Generates the HTML grid content for all movies.
+    Generates the HTML grid content for all movies, one tile at a time.
 
     Args:
-        movies (dict): The dictionary of movies from movie_storage.get_movies()
+        rows (iterable): (title, year, rating, poster_url) rows,
+                         e.g. from movie_storage.iter_movies_rows()
 
-    Returns:
-        str: The HTML string for the movie grid.
+    Yields:
+        str: The HTML list item for each movie.
     """
-    html_content = ""
+    for title, year, rating, poster_url in rows:
+        yield MOVIE_TILE_TEMPLATE.format(
+            title=html.escape(title),
+            year=year,
+            rating=rating,
+            poster_url=html.escape(poster_url or "")
+        )
 
-    for title, data in movies.items():
-        movie_title = title.replace('"', "'")
-        movie_year = data['year']
-        poster_url = data['poster_url']
 
-        rating = data['rating']
+@functools.lru_cache(maxsize=1)
+def load_template_parts(path):
+    """
+    Reads an HTML template and splits it around its title and movie grid
+    placeholders. Each template is only read from disk once.
 
-        # Build the HTML list item:
-        movie_html = f"""
-        <li>
-            <div class="movie">
-                <img class="movie-poster"
-                     src="{poster_url}"
-                     alt="{movie_title} - Rating: {rating}">
-                <div class="movie-title">{movie_title}</div>
-                <div class="movie-year">({movie_year})</div>
-            </div>
-        </li>
-        """
+    Args:
+        path (str): The path of the template file.
+
+    Returns:
+        tuple: The fragments before the title, between the title and the
+               movie grid, and after the movie grid.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        template_content = f.read()
 
-        html_content += movie_html
+    before_title, title_sep, rest = template_content.partition(
+        "__TEMPLATE_TITLE__")
+    before_grid, grid_sep, after_grid = rest.partition(
+        "__TEMPLATE_MOVIE_GRID__")
+    if not (title_sep and grid_sep):
+        raise ValueError(f"HTML template {path} is missing a placeholder")
 
-    return html_content
+    return before_title, before_grid, after_grid
 
 # ---------------- Core Functionality ---------------- #
 
@@ -49,21 +70,24 @@ def list_movies(user_id):
     """
     Lists all movies from database with their year and rating.
     """
-    movies = movie_storage.get_movies(user_id)
+    movies = movie_storage.get_movies_rows(user_id)
 
     if not movies:
         print("No movies in the database.")
         return
 
-    print(f"{len(movies)} movies in total")
-    print("-" * 30)
+    separator = "-" * 30
 
-    for title, data in movies.items():
-        print(f"🎬 {title} ({data['year']}): {data['rating']}")
+    # Build the whole listing first and print it in one go
+    lines = [f"{len(movies)} movies in total", separator]
+    for title, year, rating, poster_url in movies:
+        lines.append(f"🎬 {title} ({year}): {rating}")
         # Display the poster URL so the user knows it was fetched
-        if data.get('poster_url') and data['poster_url'] != 'N/A':
-            print(f"   Poster: {data['poster_url']}")
-        print("-" * 30)
+        if poster_url and poster_url != 'N/A':
+            lines.append(f"   Poster: {poster_url}")
+        lines.append(separator)
+
+    print("\n".join(lines))
 
 
 def add_movie(user_id):
@@ -71,11 +95,13 @@ def add_movie(user_id):
     Adds a new movie to the database using data fetched from OMDb API.
     Handles connection errors and 'movie not found' errors.
     """
-    title = cli.safe_title_input("Enter movie name: ")
+    # Imported here so startup doesn't pay for loading the HTTP client
+    import requests
+    import movies_api as api
 
-    movies = movie_storage.get_movies(user_id)
+    title = cli.safe_title_input("Enter movie name: ")
 
-    if title in movies:
+    if movie_storage.movie_exists(title, user_id):
         print(f"Movie {title} already exists!")
         return
 
@@ -92,7 +118,7 @@ def add_movie(user_id):
             f"❌ Movie '{title}' not found in OMDb. Please try another title.")
         return
 
-    movie_storage.add_movie(
+    added = movie_storage.add_movie(
         title=movies_data["title"],
         year=movies_data["year"],
         rating=movies_data["rating"],
@@ -100,9 +126,84 @@ def add_movie(user_id):
         user_id=user_id
     )
 
+    if added is None:
+        print(f"❌ Movie '{movies_data['title']}' could not be saved. Please try again.")
+        return
+    if not added:
+        # OMDb returned a title the user already has under another spelling
+        print(f"Movie {movies_data['title']} already exists!")
+        return
+
     print(f"Movie {title} successfully added")
 
 
+def add_movies_bulk(user_id, titles):
+    """
+    Adds several movies at once. The OMDb lookups run in parallel and the
+    movies found are saved in a single database transaction. Repeated
+    titles (ignoring case), titles the user already has and titles OMDb
+    doesn't know are reported and skipped. Blank lines are ignored.
+
+    Args:
+        user_id (int): The user to add the movies for.
+        titles (iterable): The movie titles to look up.
+
+    Returns:
+        int: The number of movies added.
+    """
+    import requests
+    from concurrent.futures import ThreadPoolExecutor
+    import movies_api as api
+
+    # Skip blank lines, repeated titles and movies the user already has.
+    # Repeats are matched like the OMDb cache keys, ignoring case.
+    pending = []
+    seen = set()
+    for title in titles:
+        title = title.strip()
+        if not title:
+            continue
+        if title.lower() in seen:
+            print(f"Skipping '{title}': it's already in the list.")
+            continue
+        seen.add(title.lower())
+        if movie_storage.movie_exists(title, user_id):
+            print(f"Movie {title} already exists!")
+            continue
+        pending.append(title)
+
+    print(f"Searching OMDb for {len(pending)} movie(s)...")
+    with ThreadPoolExecutor(max_workers=api.OMDB_MAX_CONNECTIONS) as executor:
+        futures = [executor.submit(api.get_movie_data, title)
+                   for title in pending]
+
+    # OMDb may map different spellings to the same movie, so key by its title
+    new_movies = {}
+    for title, future in zip(pending, futures):
+        try:
+            movies_data = future.result()
+        except requests.exceptions.RequestException:
+            print(f"Error: Could not connect to OMDb API for '{title}'.")
+            continue
+        except Exception as e:
+            # One bad lookup (e.g. an unexpected OMDb reply) only skips
+            # that title, the others were already fetched
+            print(f"Error: Could not look up '{title}': {e}")
+            continue
+
+        if movies_data is None:
+            print(f"❌ Movie '{title}' not found in OMDb.")
+        elif (movies_data["title"] in new_movies
+              or movie_storage.movie_exists(movies_data["title"], user_id)):
+            print(f"Movie {movies_data['title']} already exists!")
+        else:
+            new_movies[movies_data["title"]] = movies_data
+
+    added = movie_storage.add_movies_bulk(user_id, list(new_movies.values()))
+    print(f"{added} movie(s) successfully added")
+    return added
+
+
 def delete_movie(user_id):
     """
     Deletes a movie from the database.
@@ -120,10 +221,8 @@ def update_movie(user_id):
     """
     Updates the rating of a movie in the database.
     """
-    movies = movie_storage.get_movies(user_id)
-
     title = cli.safe_title_input("Enter movie name: ")
-    if title not in movies:
+    if not movie_storage.movie_exists(title, user_id):
         print(f"Movie {title} doesn't exist")
         return
 
@@ -141,43 +240,30 @@ def stats(user_id):
     - Best movie(s)
     - Worst movie(s)
     """
-    movies = movie_storage.get_movies(user_id)
-    if not movies:
+    movie_stats = movie_storage.get_stats(user_id)
+    if movie_stats is None:
         print("No movies in the database.")
         return
 
-    ratings = [data["rating"] for data in movies.values()]
-    average = statistics.mean(ratings)
-    median = statistics.median(ratings)
-
-    max_rating = max(ratings)
-    best_movies = [title for title,
-                   data in movies.items() if data['rating'] == max_rating]
-
-    min_rating = min(ratings)
-    worst_movies = [title for title,
-                    data in movies.items() if data['rating'] == min_rating]
-
-    print(f"Average rating: {average:.1f}")
-    print(f"Median rating: {median:.1f}")
-    print(f"Best movie(s) ({max_rating}): {', '.join(best_movies)}")
-    print(f"Worst movie(s) ({min_rating}): {', '.join(worst_movies)}")
+    print(f"Average rating: {movie_stats['average']:.1f}")
+    print(f"Median rating: {movie_stats['median']:.1f}")
+    print(
+        f"Best movie(s) ({movie_stats['max_rating']}): {', '.join(movie_stats['best_movies'])}")
+    print(
+        f"Worst movie(s) ({movie_stats['min_rating']}): {', '.join(movie_stats['worst_movies'])}")
 
 
 def random_movie(user_id):
     """
     Picks and displays a random movie from the database.
     """
-    movies = movie_storage.get_movies(user_id)
+    movie = movie_storage.get_random_movie(user_id)
 
-    if not movies:
+    if movie is None:
         print("No movies in the database.")
         return
 
-    title = random.choice(list(movies.keys()))
-    data = movies[title]
-    rating = data["rating"]
-    year = data["year"]
+    title, year, rating = movie
 
     print(f"Your movie for tonight: {title} ({year}), rated {rating}")
 
@@ -187,18 +273,15 @@ def search_movie(user_id):
     Searches for movies containing a user-provided string in the title
     and displays them with year and rating.
     """
-    movies = movie_storage.get_movies(user_id)
-
-    query = cli.safe_title_input("Enter part of the movie name: ").lower()
-    found = False
+    query = cli.safe_title_input("Enter part of the movie name: ")
+    matches = movie_storage.search_movies(user_id, query)
 
-    for title, data in movies.items():
-        if query in title.lower():
-            print(f"{title} ({data['year']}): {data['rating']}")
-            found = True
-
-    if not found:
+    if not matches:
         print("No matching movies found.")
+        return
+
+    print("\n".join(
+        f"{title} ({year}): {rating}" for title, year, rating in matches))
 
 
 def movies_sorted_by_rating(user_id):
@@ -206,21 +289,16 @@ def movies_sorted_by_rating(user_id):
     Lists all movies sorted by rating (highest to lowest).
     Handles empty database gracefully.
     """
-    movies = movie_storage.get_movies(user_id)
+    sorted_movies = movie_storage.get_movies_sorted(
+        user_id, "rating", desc=True)
 
-    if not movies:
+    if not sorted_movies:
         print("No movies in the database to sort.")
         return
 
-    sorted_movies = sorted(
-        movies.items(),
-        key=lambda item: item[1]["rating"],
-        reverse=True
-    )
-
     print("Movies sorted by rating (highest → lowest):")
-    for title, data in sorted_movies:
-        print(f"{title} ({data['year']}): {data['rating']}")
+    print("\n".join(
+        f"{title} ({year}): {rating}" for title, year, rating, _ in sorted_movies))
 
 
 def movies_sorted_by_year(user_id):
@@ -228,9 +306,7 @@ def movies_sorted_by_year(user_id):
     Lists all movies sorted by year (chronological order).
     Asks the user whether to display latest movies first or last
     """
-    movies = movie_storage.get_movies(user_id)
-
-    if not movies:
+    if not movie_storage.has_movies(user_id):
         print("No movies in the database to sort.")
         return
 
@@ -241,15 +317,12 @@ def movies_sorted_by_year(user_id):
             break
         print("Invalid input. Please enter 'y' for yes or 'n' for no.")
 
-    sorted_movies = sorted(
-        movies.items(),
-        key=lambda item: item[1]["year"],
-        reverse=reverse_order
-    )
+    sorted_movies = movie_storage.get_movies_sorted(
+        user_id, "year", desc=reverse_order)
 
     print("Movies sorted by year:")
-    for title, data in sorted_movies:
-        print(f"{title} ({data['year']}): {data['rating']}")
+    print("\n".join(
+        f"{title} ({year}): {rating}" for title, year, rating, _ in sorted_movies))
 
 
 def generate_website(user_id, user_name):
@@ -258,35 +331,36 @@ def generate_website(user_id, user_name):
     """
     TEMPLATE_PATH = "_static/index_template.html"
     OUTPUT_PATH = f"{user_name.replace(' ', '_')}.html"
-    APP_TITLE = f"{user_name}'s Movie App"
+    # The title lands in element text, so only <, > and & need escaping
+    APP_TITLE = html.escape(f"{user_name}'s Movie App", quote=False)
 
-    # 2. Get all movie data
-    movies = movie_storage.get_movies(user_id)
-    if not movies:
+    # 2. Stream the movies from the database, checking there is at least one
+    rows = movie_storage.iter_movies_rows(user_id)
+    first_row = next(rows, None)
+    if first_row is None:
         print("Cannot generate website: The database is empty.")
         return
 
-    # 3. Generate the movie grid HTML
-    movie_grid_html = create_movie_tiles(movies)
-
-    # 4. Read the template file
+    # 3. Load the template, split around its placeholders
     try:
-        with open(TEMPLATE_PATH, 'r') as f:
-            template_content = f.read()
+        before_title, before_grid, after_grid = load_template_parts(
+            TEMPLATE_PATH)
     except FileNotFoundError:
         print(
             f"Error: HTML template file not found at {TEMPLATE_PATH}. Check your _static folder.")
         return
-    # 5. Replace the placeholders
-    final_html = template_content.replace("__TEMPLATE_TITLE__", APP_TITLE)
-    final_html = final_html.replace("__TEMPLATE_MOVIE_GRID__", movie_grid_html)
 
-    # 6. Write the final HTML file
+    # 4. Write the final HTML file, one movie tile at a time. The file
+    # object buffers the small writes; newline='' skips the newline
+    # translation pass, so the page has the same \n endings everywhere.
     try:
-        with open(OUTPUT_PATH, 'w') as f:
-            f.write(final_html)
+        with open(OUTPUT_PATH, 'w', encoding='utf-8', newline='') as f:
+            f.writelines((before_title, APP_TITLE, before_grid))
+            f.writelines(create_movie_tiles(
+                itertools.chain((first_row,), rows)))
+            f.write(after_grid)
 
-        # 7. Print success message
+        # 5. Print success message
         print("✅ Website was generated successfully.")
     except Exception as e:
         print(f"❌ Error writing the output file {OUTPUT_PATH}: {e}")
@@ -1,4 +1,6 @@
+import sys
 import app.cli as cli
+import app.core as core
 import storage.movie_storage_sql as movie_storage
 
 # ---------------- Main Entry ---------------- #
@@ -7,11 +9,40 @@ import storage.movie_storage_sql as movie_storage
 def main():
     """
     Main entry point for the application.
-    Initializes database and handles user switching loop.
+    Initializes database and handles user switching loop,
+    or runs the menu choices given on the command line.
     """
     # 1. Initialize the database schema
     movie_storage.initialize_database()
 
+    # Batch mode: python main.py <user name> <choice> [<choice> ...]
+    #         or: python main.py <user name> --import <file of titles>
+    if len(sys.argv) == 2:
+        print("Usage: python main.py <user name> <choice> [<choice> ...]")
+        print("   or: python main.py <user name> --import <file>")
+        sys.exit(1)
+    if len(sys.argv) > 2:
+        user = movie_storage.get_user_by_name(sys.argv[1])
+        if user is None:
+            print(f"User '{sys.argv[1]}' does not exist.")
+            sys.exit(1)
+        if sys.argv[2] == "--import":
+            if len(sys.argv) != 4:
+                print("Usage: python main.py <user name> --import <file>")
+                sys.exit(1)
+            try:
+                with open(sys.argv[3], 'r', encoding='utf-8') as f:
+                    titles = f.read().splitlines()
+            except OSError as e:
+                print(f"Could not read '{sys.argv[3]}': {e.strerror}")
+                print("Usage: python main.py <user name> --import <file>")
+                sys.exit(1)
+            core.add_movies_bulk(user["id"], titles)
+            return
+        if not cli.run_batch(user["id"], user["name"], sys.argv[2:]):
+            sys.exit(1)
+        return
+
     cli.print_welcome()
 
     # Outer loop for user selection/switching
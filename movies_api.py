@@ -1,6 +1,12 @@
+import json
+import re
 import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy.exc import SQLAlchemyError
+from urllib3.util.retry import Retry
 import os
 from dotenv import load_dotenv
+import storage.movie_storage_sql as movie_storage
 
 load_dotenv()
 
@@ -8,13 +14,42 @@ OMDB_API_KEY = os.environ.get("OMDB_API_KEY")
 
 OMDB_URL = f"http://www.omdbapi.com/?apikey={OMDB_API_KEY}&t="
 
+# Shared session so repeated lookups reuse the same HTTP connections.
+# Connection errors and transient server errors are retried with backoff,
+# and up to OMDB_MAX_CONNECTIONS lookups can keep a connection open at once.
+OMDB_MAX_CONNECTIONS = 8
 
-def get_movie_data(title):
+_session = requests.Session()
+_retry_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=OMDB_MAX_CONNECTIONS,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",)
+    )
+)
+_session.mount("http://", _retry_adapter)
+_session.mount("https://", _retry_adapter)
+
+# OMDb's Year starts with four digits but may carry more, e.g. "2015–"
+# for a series that's still running
+_YEAR_RE = re.compile(r"(\d{4})")
+
+# How long a cached OMDb lookup is reused before asking OMDb again (30 days)
+OMDB_CACHE_TTL = 30 * 24 * 60 * 60
+
+
+def get_movie_data(title, use_cache=True):
     """
       Fetches movie details (Title, Year, Rating, Poster) from OMDb API.
+      Found movies are cached in the database for OMDB_CACHE_TTL seconds.
 
       Args:
           title (str): The title of the movie to search for.
+          use_cache (bool): Whether a cached lookup may be returned.
+                            Pass False to always ask OMDb.
 
       Returns:
           dict: A dictionary containing the required movie data, 
@@ -24,10 +59,22 @@ def get_movie_data(title):
           requests.exceptions.RequestException: If there's a connection error.
       """
 
+    # The cache only saves a round trip, so a database error while reading
+    # or writing it falls back to OMDb instead of failing the lookup
+    cache_key = title.lower()
+    if use_cache:
+        try:
+            cached = movie_storage.get_cached_omdb_response(
+                cache_key, OMDB_CACHE_TTL)
+        except SQLAlchemyError:
+            cached = None
+        if cached is not None:
+            return json.loads(cached)
+
     search_url = OMDB_URL + title
 
     try:
-        response = requests.get(search_url, timeout=10)
+        response = _session.get(search_url, timeout=10)
         response.raise_for_status()
     except requests.exceptions.RequestException as e:
         raise e
@@ -43,10 +90,17 @@ def get_movie_data(title):
     except ValueError:
         rating = 0.0
 
+    year_match = _YEAR_RE.match(data.get("Year") or "")
+    year = int(year_match.group(1)) if year_match else 0
+
     movie_info = {
         "title": data.get("Title"),
-        "year": int(data.get("Year")),
+        "year": year,
         "rating": rating,
         "poster_url": data.get("Poster")
     }
+    try:
+        movie_storage.cache_omdb_response(cache_key, json.dumps(movie_info))
+    except SQLAlchemyError:
+        pass
     return movie_info
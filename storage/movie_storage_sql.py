@@ -1,15 +1,128 @@
-from sqlalchemy import create_engine, text
+import os
+import time
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import SQLAlchemyError
 
 # Define database URL
 DATABASE_URL = "sqlite:///data/movies.db"
 
-# Create a database engine
-engine = create_engine(DATABASE_URL, echo=True)
+# Create a database engine. Its pool hands the same SQLite connection
+# back to every call instead of reconnecting each time. Set SQL_ECHO=1
+# to log every statement while debugging.
+engine = create_engine(DATABASE_URL, echo=os.environ.get("SQL_ECHO") == "1",
+                       connect_args={"check_same_thread": False})
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tunes each new SQLite connection once, when the pool opens it."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-64000")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+# In-memory cache of each user's movies, keyed by user_id. Each entry
+# maps title -> (title, year, rating, poster_url) row, in the order the
+# movies were added. Filled on first read and kept in sync by the write
+# functions below.
+_movies_cache = {}
+
+# Every user as (id, name) rows, or None until first read. Cleared by
+# the functions that create or delete users.
+_users_cache = None
+
+# Statements run by the functions below, built once at import. SQLAlchemy
+# keys its compiled-statement cache on these objects, so reusing them
+# skips re-parsing the SQL on every call.
+_SQL_GET_USERS = text("SELECT id, name FROM users")
+_SQL_GET_USER = text("SELECT id, name FROM users WHERE name = :name")
+_SQL_ADD_USER = text(
+    "INSERT INTO users (name) VALUES (:name) ON CONFLICT(name) DO NOTHING RETURNING id")
+_SQL_DELETE_USER = text("DELETE FROM users WHERE id = :user_id")
+
+_SQL_GET_MOVIES = text(
+    "SELECT title, year, rating, poster_url FROM movies WHERE user_id = :user_id ORDER BY id")
+_SQL_HAS_MOVIES = text("SELECT 1 FROM movies WHERE user_id = :user_id LIMIT 1")
+_SQL_MOVIE_EXISTS = text(
+    "SELECT 1 FROM movies WHERE user_id = :user_id AND title = :title LIMIT 1")
+# LIKE ignores case by itself: SQLite folds ASCII letters unless
+# PRAGMA case_sensitive_like is turned on, which this module never does
+_SQL_SEARCH_MOVIES = text(
+    "SELECT title, year, rating FROM movies WHERE user_id = :user_id AND title LIKE :pattern ESCAPE '\\'")
+_SQL_RANDOM_MOVIE = text(
+    "SELECT title, year, rating FROM movies WHERE user_id = :user_id ORDER BY RANDOM() LIMIT 1")
+_SQL_ADD_MOVIE = text(
+    "INSERT INTO movies (title, year, rating, poster_url, user_id) VALUES (:title, :year, :rating, :poster_url, :user_id) ON CONFLICT(title, user_id) DO NOTHING")
+_SQL_DELETE_MOVIE = text(
+    "DELETE FROM movies WHERE title = :title AND user_id = :user_id")
+_SQL_UPDATE_MOVIE = text(
+    "UPDATE movies SET rating = :rating WHERE title = :title AND user_id = :user_id")
+_SQL_DELETE_USER_MOVIES = text("DELETE FROM movies WHERE user_id = :user_id")
+
+_SQL_STATS = text(
+    "SELECT COUNT(*), AVG(rating), MIN(rating), MAX(rating) FROM movies WHERE user_id = :user_id")
+_SQL_MEDIAN = text(
+    "SELECT AVG(rating) FROM (SELECT rating FROM movies WHERE user_id = :user_id ORDER BY rating LIMIT :limit OFFSET :offset)")
+_SQL_EXTREMES = text(
+    "SELECT title, rating FROM movies WHERE user_id = :user_id AND rating IN (:min_rating, :max_rating) ORDER BY id")
+
+_SQL_GET_OMDB = text(
+    "SELECT payload FROM omdb_cache WHERE title_lower = :title_lower AND fetched_at >= :oldest")
+_SQL_PUT_OMDB = text(
+    "INSERT OR REPLACE INTO omdb_cache (title_lower, payload, fetched_at) VALUES (:title_lower, :payload, :fetched_at)")
+
+# get_movies_sorted() statements by (column, descending). Column names
+# can't be bound as query parameters, so only these ever get run. Ties
+# keep the order the movies were added in.
+_SQL_GET_MOVIES_SORTED = {
+    (key, desc): text(
+        f"SELECT title, year, rating, poster_url FROM movies WHERE user_id = :user_id ORDER BY {key} {'DESC' if desc else 'ASC'}, id")
+    for key in ("rating", "year")
+    for desc in (False, True)
+}
+
+# Schema of the movies table, formatted with the table name so a legacy
+# table can be rebuilt under a temporary name
+_MOVIES_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        rating REAL NOT NULL,
+        poster_url TEXT,
+        user_id INTEGER NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+        UNIQUE(title, user_id)
+    )
+"""
+
+
+def _is_legacy_movies_table(connection):
+    """
+    Checks whether the movies table still has a UNIQUE constraint on title
+    alone or a user_id foreign key without ON DELETE CASCADE.
+    """
+    for _, name, unique, *_ in connection.execute(
+            text("PRAGMA index_list(movies)")).fetchall():
+        columns = [row[2] for row in connection.execute(
+            text(f"PRAGMA index_info('{name}')"))]
+        if unique and columns == ["title"]:
+            return True
+
+    return any(row[2] == "users" and row[6] != "CASCADE"
+               for row in connection.execute(text("PRAGMA foreign_key_list(movies)")))
 
 
 def initialize_database():
     """Ensures the users and movies tables are created upon startup."""
-    with engine.connect() as connection:
+    with engine.begin() as connection:
         # Create the users table
         connection.execute(text("""
             CREATE TABLE IF NOT EXISTS users (
@@ -19,26 +132,93 @@ def initialize_database():
         """))
 
         # Create the movies table
+        connection.execute(text(_MOVIES_TABLE_SQL.format(table="movies")))
+
+        # Databases from before poster support lack the poster_url column
+        movie_columns = {row[1] for row in connection.execute(
+            text("PRAGMA table_info(movies)"))}
+        if "poster_url" not in movie_columns:
+            connection.execute(
+                text("ALTER TABLE movies ADD COLUMN poster_url TEXT"))
+
+        # Databases from before per-user libraries made title unique on its
+        # own (so two users couldn't own the same movie) and lack the
+        # cascade; SQLite can't drop a constraint, so rebuild the table
+        if _is_legacy_movies_table(connection):
+            # pysqlite runs CREATE TABLE outside the transaction, so a
+            # rebuild that failed halfway may have left this table behind
+            connection.execute(text("DROP TABLE IF EXISTS movies_migrated"))
+            connection.execute(
+                text(_MOVIES_TABLE_SQL.format(table="movies_migrated")))
+
+            # Foreign keys weren't enforced before, so movies may point at
+            # users that no longer exist. They can't be copied into a table
+            # that enforces them, and no user could ever see them anyway.
+            orphans = connection.execute(text("""
+                SELECT COUNT(*) FROM movies
+                WHERE user_id NOT IN (SELECT id FROM users)
+            """)).scalar()
+            connection.execute(text("""
+                INSERT INTO movies_migrated (id, title, year, rating, poster_url, user_id)
+                SELECT id, title, year, rating, poster_url, user_id FROM movies
+                WHERE user_id IN (SELECT id FROM users)
+            """))
+            connection.execute(text("DROP TABLE movies"))
+            connection.execute(
+                text("ALTER TABLE movies_migrated RENAME TO movies"))
+            if orphans:
+                print(f"Removed {orphans} movie(s) that belonged to no user "
+                      "while upgrading the database.")
+
+        # Create the OMDb response cache, shared by all users
         connection.execute(text("""
-            CREATE TABLE IF NOT EXISTS movies (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                year INTEGER NOT NULL,
-                rating REAL NOT NULL,
-                poster_url TEXT,
-                user_id INTEGER NOT NULL,  
-                FOREIGN KEY (user_id) REFERENCES users(id),
-                UNIQUE(title, user_id) 
+            CREATE TABLE IF NOT EXISTS omdb_cache (
+                title_lower TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                fetched_at REAL NOT NULL
             )
         """))
-        connection.commit()
+
+        # Index for reading a user's movies in the order they were added:
+        # SQLite appends the rowid (movies.id) to every index, so this one
+        # serves "WHERE user_id = ? ORDER BY id" without a sort step
+        connection.execute(text("""
+            CREATE INDEX IF NOT EXISTS idx_movies_user
+            ON movies (user_id)
+        """))
+
+        # Indexes backing the sorted movie listings
+        connection.execute(text("""
+            CREATE INDEX IF NOT EXISTS idx_movies_user_rating
+            ON movies (user_id, rating)
+        """))
+        connection.execute(text("""
+            CREATE INDEX IF NOT EXISTS idx_movies_user_year
+            ON movies (user_id, year)
+        """))
+
+
+def _invalidate_users_cache():
+    """Forces the next get_all_users() call to re-read the users table."""
+    global _users_cache
+    _users_cache = None
+
+
+def get_all_users():
+    """Retrieves the ID and name of every user (cached until a user is created or deleted)."""
+    global _users_cache
+    if _users_cache is None:
+        with engine.connect() as connection:
+            result = connection.execute(_SQL_GET_USERS)
+            _users_cache = result.fetchall()
+    return _users_cache
 
 
 def get_user_by_name(name):
     """Retrieves a user's ID and name from the database, or None if not found."""
     with engine.connect() as connection:
         result = connection.execute(
-            text("SELECT id, name FROM users WHERE name = :name"),
+            _SQL_GET_USER,
             {"name": name}
         ).fetchone()
 
@@ -50,91 +230,312 @@ def get_user_by_name(name):
 
 def create_new_user(name):
     """Adds a new user to the database and returns their newly created ID."""
+    with engine.begin() as connection:
+        # No row comes back if the name is already taken
+        row = connection.execute(
+            _SQL_ADD_USER,
+            {"name": name}
+        ).fetchone()
+
+    if row is None:
+        return None
+
+    new_id = row[0]
+    _invalidate_users_cache()
+    # A new user never starts with cached movies
+    invalidate_movies_cache(new_id)
+    return new_id
+
+
+def invalidate_movies_cache(user_id=None):
+    """Drops the cached movies of one user, or of every user if no ID is given."""
+    if user_id is None:
+        _movies_cache.clear()
+    else:
+        _movies_cache.pop(user_id, None)
+
+
+def get_movies_rows(user_id):
+    """
+    Retrieves a user's movies as (title, year, rating, poster_url) rows in
+    the order they were added. Served from the cache after the first call.
+    """
+    if user_id not in _movies_cache:
+        with engine.connect() as connection:
+            result = connection.execute(
+                _SQL_GET_MOVIES, {
+                    "user_id": user_id}
+            )
+            _movies_cache[user_id] = {
+                row[0]: tuple(row) for row in result}
+
+    return list(_movies_cache[user_id].values())
+
+
+def iter_movies_rows(user_id):
+    """
+    Yields a user's movies as (title, year, rating, poster_url) rows.
+    Uses the cache when it's filled, otherwise streams them straight
+    from the cursor without caching.
+    """
+    if user_id in _movies_cache:
+        yield from list(_movies_cache[user_id].values())
+        return
+
     with engine.connect() as connection:
-        # Check if user already exists
-        if get_user_by_name(name):
-            return None
+        result = connection.execute(
+            _SQL_GET_MOVIES, {
+                "user_id": user_id}
+        )
+        # Fetch in fixed-size batches rather than buffering the whole result
+        yield from result.yield_per(256)
 
+
+def has_movies(user_id):
+    """Checks whether a user has any movies."""
+    if user_id in _movies_cache:
+        return bool(_movies_cache[user_id])
+
+    with engine.connect() as connection:
+        result = connection.execute(_SQL_HAS_MOVIES, {"user_id": user_id})
+        return result.first() is not None
+
+
+def movie_exists(title, user_id):
+    """Checks whether a user already has a movie with the given title."""
+    if user_id in _movies_cache:
+        return title in _movies_cache[user_id]
+
+    with engine.connect() as connection:
         result = connection.execute(
-            text("INSERT INTO users (name) VALUES (:name) RETURNING id"),
-            {"name": name}
+            _SQL_MOVIE_EXISTS, {
+                "user_id": user_id, "title": title}
         )
+        return result.first() is not None
 
-        new_id = result.fetchone()[0]
-        connection.commit()
-        return new_id
 
+def get_movies_sorted(user_id, key, desc=False):
+    """
+    Retrieves a user's movies ordered by 'rating' or 'year', letting SQLite
+    do the sorting. Returns (title, year, rating, poster_url) rows.
+    """
+    statement = _SQL_GET_MOVIES_SORTED.get((key, bool(desc)))
+    if statement is None:
+        raise ValueError(f"Cannot sort movies by '{key}'")
 
-def get_movies(user_id):
-    """Retrieves all movies from the database."""
     with engine.connect() as connection:
         result = connection.execute(
-            text("SELECT title, year, rating, poster_url FROM movies WHERE user_id = :user_id"), {
+            statement, {
                 "user_id": user_id}
         )
-        movies = result.fetchall()
+        return result.fetchall()
+
+
+def search_movies(user_id, query):
+    """
+    Retrieves a user's movies whose title contains the query, ignoring
+    ASCII case. Returns (title, year, rating) rows.
+    """
+    # Escape LIKE wildcards so the query is matched literally
+    pattern = query.replace("\\", "\\\\").replace(
+        "%", "\\%").replace("_", "\\_")
+
+    with engine.connect() as connection:
+        result = connection.execute(
+            _SQL_SEARCH_MOVIES, {
+                "user_id": user_id, "pattern": f"%{pattern}%"}
+        )
+        return result.fetchall()
+
+
+def get_stats(user_id):
+    """
+    Computes a user's rating statistics in SQL. Returns a dict with the
+    average, median, max_rating, best_movies, min_rating and worst_movies,
+    or None if the user has no movies.
+    """
+    params = {"user_id": user_id}
+    with engine.connect() as connection:
+        count, average, min_rating, max_rating = connection.execute(
+            _SQL_STATS,
+            params
+        ).fetchone()
+        if count == 0:
+            return None
+
+        # The middle rating, or the mean of the middle two for an even count
+        median = connection.execute(
+            _SQL_MEDIAN,
+            {"user_id": user_id, "limit": 2 - count % 2,
+             "offset": (count - 1) // 2}
+        ).scalar()
+
+        extremes = connection.execute(
+            _SQL_EXTREMES,
+            {"user_id": user_id, "min_rating": min_rating,
+             "max_rating": max_rating}
+        ).fetchall()
+
     return {
-        row[0]: {
-            "year": row[1],
-            "rating": row[2],
-            "poster_url": row[3]
-        }
-        for row in movies
+        "average": average,
+        "median": median,
+        "max_rating": max_rating,
+        "best_movies": [title for title, rating in extremes if rating == max_rating],
+        "min_rating": min_rating,
+        "worst_movies": [title for title, rating in extremes if rating == min_rating]
     }
 
 
-def add_movie(title, year, rating, poster_url, user_id):
-    """Add a new movie to the database."""
+def get_random_movie(user_id):
+    """
+    Retrieves one of a user's movies at random as a (title, year, rating)
+    row, or None if they have no movies.
+    """
     with engine.connect() as connection:
-        try:
-            connection.execute(text("INSERT INTO movies (title, year, rating, poster_url, user_id) VALUES (:title, :year, :rating, :poster_url, :user_id)"),
-                               {"title": title,
-                                "year": year,
-                                "rating": rating,
-                                "poster_url": poster_url,
-                                "user_id": user_id
-                                }
-                               )
-            connection.commit()
-        except Exception as e:
-            print(f"Error: {e}")
+        result = connection.execute(
+            _SQL_RANDOM_MOVIE, {
+                "user_id": user_id}
+        )
+        return result.fetchone()
+
+
+def add_movie(title, year, rating, poster_url, user_id):
+    """
+    Add a new movie to the database.
+
+    Returns:
+        bool: True if the movie was added, False if the user already has a
+        movie with that title, None if the insert failed.
+    """
+    try:
+        # The UNIQUE(title, user_id) constraint does the duplicate check
+        with engine.begin() as connection:
+            result = connection.execute(_SQL_ADD_MOVIE,
+                                        {"title": title,
+                                         "year": year,
+                                         "rating": rating,
+                                         "poster_url": poster_url,
+                                         "user_id": user_id
+                                         }
+                                        )
+    except SQLAlchemyError as e:
+        invalidate_movies_cache(user_id)
+        # Report the database's reason, not SQLAlchemy's dump of the SQL
+        print(f"Error: {getattr(e, 'orig', None) or e}")
+        return None
+
+    if result.rowcount != 1:
+        return False
+    if user_id in _movies_cache:
+        _movies_cache[user_id][title] = (title, year, rating, poster_url)
+    return True
+
+
+def add_movies_bulk(user_id, movies):
+    """
+    Adds several movies for a user in a single transaction. Titles the user
+    already has are skipped.
+
+    Args:
+        user_id (int): The user the movies belong to.
+        movies (list): Dicts with 'title', 'year', 'rating' and 'poster_url'.
+
+    Returns:
+        int: The number of movies added. Nothing is added if any insert fails.
+    """
+    if not movies:
+        return 0
+
+    params = [{**movie, "user_id": user_id} for movie in movies]
+    try:
+        # A list of parameter sets makes SQLAlchemy use executemany
+        with engine.begin() as connection:
+            result = connection.execute(_SQL_ADD_MOVIE, params)
+    except SQLAlchemyError as e:
+        invalidate_movies_cache(user_id)
+        print(f"Error: {getattr(e, 'orig', None) or e}")
+        return 0
+
+    added = result.rowcount
+    if added != len(movies):
+        # Some titles were skipped and we can't tell which, so reload later
+        invalidate_movies_cache(user_id)
+    elif user_id in _movies_cache:
+        for movie in movies:
+            _movies_cache[user_id][movie["title"]] = (
+                movie["title"], movie["year"], movie["rating"], movie["poster_url"])
+    return added
 
 
 def delete_movie(title, user_id):
     """Delete a movie from the database."""
-    with engine.connect() as connection:
+    with engine.begin() as connection:
         result = connection.execute(
-            text("DELETE FROM movies WHERE title = :title AND user_id = :user_id"), {"title": title, "user_id": user_id})
-        connection.commit()
-        return result.rowcount > 0
+            _SQL_DELETE_MOVIE, {"title": title, "user_id": user_id})
+
+    if result.rowcount > 0:
+        _movies_cache.get(user_id, {}).pop(title, None)
+        return True
+    return False
 
 
 def update_movie(title, rating, user_id):
     """Update the rating of a movie in the database."""
-    with engine.connect() as connection:
-        result = connection.execute(text("UPDATE movies SET rating = :rating WHERE title = :title AND user_id = :user_id"),
+    with engine.begin() as connection:
+        result = connection.execute(_SQL_UPDATE_MOVIE,
                                     {"title": title, "rating": rating, "user_id": user_id})
-        connection.commit()
-        return result.rowcount > 0
 
+    if result.rowcount > 0:
+        cached = _movies_cache.get(user_id, {})
+        if title in cached:
+            _, year, _, poster_url = cached[title]
+            cached[title] = (title, year, rating, poster_url)
+        return True
+    return False
 
-def delete_movies_by_user_id(user_id):
-    """Deletes all movies associated with a given user ID."""
-    with engine.connect() as connection:
-        result = connection.execute(
-            text("DELETE FROM movies WHERE user_id = :user_id"),
+
+def delete_user_with_movies(user_id):
+    """
+    Deletes a user and all their movies in a single transaction.
+    Returns a (user_deleted, movies_deleted) tuple.
+    """
+    with engine.begin() as connection:
+        # Deleted explicitly rather than through ON DELETE CASCADE so the
+        # count can be reported
+        movies_result = connection.execute(
+            _SQL_DELETE_USER_MOVIES,
+            {"user_id": user_id}
+        )
+        user_result = connection.execute(
+            _SQL_DELETE_USER,
             {"user_id": user_id}
         )
-        connection.commit()
-        return result.rowcount
+
+    invalidate_movies_cache(user_id)
+    if user_result.rowcount > 0:
+        _invalidate_users_cache()
+        return True, movies_result.rowcount
+    return False, 0
 
 
-def delete_user(user_id):
-    """Deletes a user from the users table."""
+def get_cached_omdb_response(title_lower, max_age):
+    """
+    Retrieves the cached OMDb payload for a lowercased title, or None if
+    there is none or it is older than max_age seconds.
+    """
     with engine.connect() as connection:
         result = connection.execute(
-            text("DELETE FROM users WHERE id = :user_id"),
-            {"user_id": user_id}
+            _SQL_GET_OMDB,
+            {"title_lower": title_lower, "oldest": time.time() - max_age}
+        ).fetchone()
+    return result[0] if result else None
+
+
+def cache_omdb_response(title_lower, payload):
+    """Stores (or refreshes) the OMDb payload for a lowercased title."""
+    with engine.begin() as connection:
+        connection.execute(
+            _SQL_PUT_OMDB,
+            {"title_lower": title_lower, "payload": payload,
+             "fetched_at": time.time()}
         )
-        connection.commit()
-        return result.rowcount > 0